@@ -1,5 +1,8 @@
 import { Elysia } from "elysia";
+import { mkdir, rename, rm } from "fs/promises";
 import { join } from "path";
+import { promisify } from "util";
+import { gzip } from "zlib";
 
 // ========================================
 // Types
@@ -15,34 +18,273 @@ type ElysiaWebSocket = any; // Using any for Elysia's wrapped WebSocket
 interface ParsedMessage {
   request_id?: string;
   result?: {
-    screenshot?: string;
+    screenshot?: string | Uint8Array;
     url?: string;
     [key: string]: any;
   };
   [key: string]: any;
 }
 
+interface CacheEntry<T> {
+  expires: number;
+  value: T;
+  size: number;
+}
+
+interface CachedScreenshot {
+  filename: string;
+  filepath: string;
+  url: string;
+}
+
+interface OutgoingRequest {
+  type: string;
+  url: string;
+  request_id: string;
+  [key: string]: any;
+}
+
+interface CapturedScreenshot {
+  error?: string;
+  bytes?: Uint8Array;
+  url: string;
+  // Resolves to whether the file landed on disk under its final name
+  saved: Promise<boolean>;
+}
+
+interface ScreenshotFile {
+  filename: string;
+  created: number;
+  size: number;
+}
+
 interface ResponseQueue {
-  promise: Promise<ParsedMessage>;
   resolve: (value: ParsedMessage) => void;
   reject: (reason?: any) => void;
   timeout: NodeJS.Timeout;
+  clientId: string;
 }
 
 // ========================================
-// Global State
+// Concurrency Control
 // ========================================
 
-const clientList: ElysiaWebSocket[] = [];
-const responseQueues = new Map<string, ResponseQueue>();
+// Limits how many requests are dispatched to the extensions at once; the
+// rest wait here instead of piling up behind the extension's tab pool
+class Semaphore {
+  private available: number;
+  private waiters: (() => void)[] = [];
+
+  constructor(count: number) {
+    this.available = count;
+  }
+
+  async acquire(): Promise<void> {
+    if (this.available > 0) {
+      this.available--;
+      return;
+    }
+    await new Promise<void>((resolve) => this.waiters.push(resolve));
+  }
+
+  release(): void {
+    const next = this.waiters.shift();
+    if (next) {
+      next();
+    } else {
+      this.available++;
+    }
+  }
+}
+
+// ========================================
+// Result Cache
+// ========================================
+
+// TTL cache that evicts the oldest entry once it grows past maxEntries or
+// once the summed sizeOf() of its values passes maxSize
+class ResultCache<T> {
+  private entries = new Map<string, CacheEntry<T>>();
+  private totalSize = 0;
+
+  constructor(
+    private ttlMs: number,
+    private maxEntries: number,
+    private maxSize: number = Infinity,
+    private sizeOf: (value: T) => number = () => 0,
+  ) {}
+
+  get(key: string): T | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) {
+      return undefined;
+    }
+    if (entry.expires <= Date.now()) {
+      this.delete(key);
+      return undefined;
+    }
+    return entry.value;
+  }
+
+  set(key: string, value: T): void {
+    // Every entry gets the same TTL and re-inserting moves a key to the end,
+    // so the Map is ordered by expiry: expired entries are always at the
+    // front and the first key is always the oldest
+    const now = Date.now();
+    for (const [oldestKey, entry] of this.entries) {
+      if (entry.expires > now) {
+        break;
+      }
+      this.delete(oldestKey);
+    }
+
+    this.delete(key);
+    const size = this.sizeOf(value);
+    this.entries.set(key, { expires: now + this.ttlMs, value, size });
+    this.totalSize += size;
+
+    while (
+      this.entries.size > this.maxEntries ||
+      this.totalSize > this.maxSize
+    ) {
+      const oldest = this.entries.keys().next().value;
+      if (oldest === undefined) {
+        break;
+      }
+      this.delete(oldest);
+    }
+  }
+
+  delete(key: string): void {
+    const entry = this.entries.get(key);
+    if (entry) {
+      this.totalSize -= entry.size;
+      this.entries.delete(key);
+    }
+  }
+}
 
 // ========================================
 // Configuration
 // ========================================
 
 const TIMEOUT_MS = 300000; // 5 minutes
+const FETCH_CACHE_TTL_MS = 60000;
+const SCREENSHOT_CACHE_TTL_MS = 1800000; // 30 minutes
+const RESULT_CACHE_MAX_ENTRIES = 1024;
+// Upper bound on the cached HTML, counted in characters across all entries
+const FETCH_CACHE_MAX_CHARS = 256 * 1024 * 1024;
+const MAX_FETCH_CONCURRENCY = Number(process.env.MAX_FETCH_CONCURRENCY) || 12;
+const MAX_SCREENSHOT_CONCURRENCY =
+  Number(process.env.MAX_SCREENSHOT_CONCURRENCY) || 4;
+// Clients report their tab pool size when they connect and are capped at it;
+// this applies only until that report arrives
+const MAX_INFLIGHT_PER_CLIENT =
+  Number(process.env.MAX_INFLIGHT_PER_CLIENT) || 2;
+// How long a request waits for a client slot before failing as busy
+const CLIENT_WAIT_MS = Number(process.env.CLIENT_WAIT_MS) || 60000;
 const PORT = 9999;
-const SCREENSHOTS_DIR = "./screenshots";
+const LOG_LEVEL = process.env.LOG_LEVEL || "info";
+// Resolved once against the server directory rather than against the
+// working directory on every file access
+const SCREENSHOTS_DIR = join(import.meta.dir, "..", "screenshots");
+const SCREENSHOT_EXTENSIONS = new Map([
+  ["jpeg", "jpg"],
+  ["png", "png"],
+]);
+const DEFAULT_SCREENSHOT_FORMAT = "jpeg";
+// Oldest screenshots are deleted once the directory grows past this size
+const SCREENSHOTS_MAX_BYTES = 100 * 1024 * 1024;
+// Filenames are stable per URL and format and get overwritten on refresh, so
+// clients must revalidate every time; the ETag keeps that to a 304
+const SCREENSHOT_CACHE_CONTROL = "no-cache";
+const COMPRESSION_MIN_BYTES = 1024;
+const MAX_BATCH_URLS = 100;
+// Requests arriving within this window go out to the extension in one frame
+const BATCH_WINDOW_MS = 20;
+const MAX_BATCH_SIZE = 32;
+// Query parameters that only carry tracking data and never change the page
+const TRACKING_PARAMS = new Set([
+  "gclid",
+  "dclid",
+  "fbclid",
+  "msclkid",
+  "yclid",
+  "mc_cid",
+  "mc_eid",
+  "_ga",
+]);
+// Overrides how long a page must be free of network requests before the
+// extension treats it as loaded
+const NETWORK_IDLE_MS = Number(process.env.NETWORK_IDLE_MS) || undefined;
+// Hosts whose DNS the extension should warm up as soon as it connects
+const HOT_DOMAINS = (process.env.HOT_DOMAINS || "")
+  .split(",")
+  .map((host) => host.trim())
+  .filter(Boolean);
+
+// ========================================
+// Global State
+// ========================================
+
+// Keyed by connection id: Elysia hands each handler a fresh wrapper around
+// the socket, so the wrapper itself cannot identify a client
+const clients = new Map<string, ElysiaWebSocket>();
+const responseQueues = new Map<string, ResponseQueue>();
+const fetchCache = new ResultCache<ParsedMessage["result"]>(
+  FETCH_CACHE_TTL_MS,
+  RESULT_CACHE_MAX_ENTRIES,
+  FETCH_CACHE_MAX_CHARS,
+  (result) => (typeof result?.html === "string" ? result.html.length : 0),
+);
+const screenshotCache = new ResultCache<CachedScreenshot>(
+  SCREENSHOT_CACHE_TTL_MS,
+  RESULT_CACHE_MAX_ENTRIES,
+);
+const inflightFetches = new Map<string, Promise<ParsedMessage>>();
+const inflightScreenshots = new Map<string, Promise<CapturedScreenshot>>();
+let screenshotsSweep: Promise<void> | undefined;
+const pendingBatches = new Map<ElysiaWebSocket, OutgoingRequest[]>();
+const inflightPerClient = new Map<string, number>();
+const clientCapacity = new Map<string, number>();
+// Requests waiting for a client slot, woken whenever one may have freed up
+const clientWaiters = new Set<() => void>();
+let batchTimer: NodeJS.Timeout | undefined;
+const fetchSemaphore = new Semaphore(MAX_FETCH_CONCURRENCY);
+const screenshotSemaphore = new Semaphore(MAX_SCREENSHOT_CONCURRENCY);
+
+// ========================================
+// Logging
+// ========================================
+
+const LOG_LEVELS = ["debug", "info", "warn", "error"] as const;
+type LogLevel = (typeof LOG_LEVELS)[number];
+
+// Unknown LOG_LEVEL values fall back to "info"
+const configuredLogLevel = LOG_LEVELS.indexOf(LOG_LEVEL as LogLevel);
+const minLogLevel =
+  configuredLogLevel === -1 ? LOG_LEVELS.indexOf("info") : configuredLogLevel;
+
+function log(level: LogLevel, message: string, ...details: unknown[]): void {
+  if (LOG_LEVELS.indexOf(level) < minLogLevel) {
+    return;
+  }
+  console[level](
+    `${new Date().toISOString()} ${level.toUpperCase()} ${message}`,
+    ...details,
+  );
+}
+
+const logger = {
+  debug: (message: string, ...details: unknown[]) =>
+    log("debug", message, ...details),
+  info: (message: string, ...details: unknown[]) =>
+    log("info", message, ...details),
+  warn: (message: string, ...details: unknown[]) =>
+    log("warn", message, ...details),
+  error: (message: string, ...details: unknown[]) =>
+    log("error", message, ...details),
+};
 
 // ========================================
 // Helper Functions
@@ -52,22 +294,104 @@ function generateUUID(): string {
   return crypto.randomUUID();
 }
 
-function createTimestamp(): string {
-  return new Date()
-    .toISOString()
-    .replace(/[-:]/g, "")
-    .replace("T", "_")
-    .split(".")[0];
+// The same page in the same format always maps to the same file, so repeat
+// captures overwrite one file instead of piling up new ones
+function screenshotFilename(cacheKey: string, extension: string): string {
+  const hash = new Bun.CryptoHasher("sha256")
+    .update(cacheKey)
+    .digest("hex")
+    .slice(0, 16);
+  return `screenshot_${hash}.${extension}`;
 }
 
-function removeClient(ws: ElysiaWebSocket): void {
-  const index = clientList.indexOf(ws);
-  if (index > -1) {
-    clientList.splice(index, 1);
+// A screenshot on disk younger than the cache TTL is as good as a cache hit,
+// which also keeps repeats fast across server restarts
+async function isFreshOnDisk(filepath: string): Promise<boolean> {
+  try {
+    const stats = await Bun.file(filepath).stat();
+    return Date.now() - stats.mtime.getTime() < SCREENSHOT_CACHE_TTL_MS;
+  } catch {
+    return false;
   }
 }
 
-function createResponseQueue(requestId: string): Promise<ParsedMessage> {
+function errorMessage(e: unknown): string {
+  return e instanceof Error ? e.message : String(e);
+}
+
+const gzipAsync = promisify(gzip);
+
+// Gzips large bodies for clients that accept it; HTML compresses well and
+// /fetch responses are often several megabytes. zlib runs on the thread
+// pool, so compressing never stalls the event loop serving the extensions.
+async function compressibleResponse(
+  request: Request,
+  body: string,
+  headers: Record<string, string>,
+): Promise<Response> {
+  const acceptsGzip = request.headers
+    .get("accept-encoding")
+    ?.includes("gzip");
+
+  if (!acceptsGzip || body.length < COMPRESSION_MIN_BYTES) {
+    return new Response(body, { headers });
+  }
+
+  return new Response(await gzipAsync(body, { level: 4 }), {
+    headers: {
+      ...headers,
+      "Content-Encoding": "gzip",
+      Vary: "Accept-Encoding",
+    },
+  });
+}
+
+function inlineScreenshotHeaders(
+  format: string,
+  finalUrl: string,
+): Record<string, string> {
+  return {
+    "Content-Type": `image/${format}`,
+    "X-Final-URL": finalUrl,
+  };
+}
+
+// Screenshots normally arrive as raw bytes in a binary frame; a base64 data
+// URL is still accepted from extensions that send them as JSON
+function screenshotBytes(screenshot: string | Uint8Array): Uint8Array {
+  if (typeof screenshot !== "string") {
+    return screenshot;
+  }
+
+  // Remove data:image/...;base64, prefix if present; only the first comma
+  // matters, so there is no need to split the whole payload
+  const offset = screenshot.startsWith("data:image")
+    ? screenshot.indexOf(",") + 1
+    : 0;
+
+  return Buffer.from(screenshot.slice(offset), "base64");
+}
+
+// Binary frames are a 4-byte big-endian header length, a JSON header and
+// the screenshot bytes, which spares base64 and JSON-escaping the image
+function parseBinaryMessage(data: Uint8Array): ParsedMessage {
+  const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+  const headerLength = view.getUint32(0);
+  const parsedData: ParsedMessage = JSON.parse(
+    new TextDecoder().decode(data.subarray(4, 4 + headerLength)),
+  );
+
+  parsedData.result = {
+    ...parsedData.result,
+    screenshot: data.subarray(4 + headerLength),
+  };
+  return parsedData;
+}
+
+function createResponseQueue(
+  requestId: string,
+  clientId: string,
+): Promise<ParsedMessage> {
   let resolveResponse: (value: ParsedMessage) => void;
   let rejectResponse: (reason?: any) => void;
 
@@ -77,63 +401,411 @@ function createResponseQueue(requestId: string): Promise<ParsedMessage> {
   });
 
   const timeout = setTimeout(() => {
-    responseQueues.delete(requestId);
-    rejectResponse(new Error("Request timed out"));
+    rejectResponseQueue(requestId, new Error("Request timed out"));
   }, TIMEOUT_MS);
 
   responseQueues.set(requestId, {
-    promise: responsePromise,
     resolve: resolveResponse!,
     reject: rejectResponse!,
     timeout,
+    clientId,
   });
+  adjustInflight(clientId, 1);
 
   return responsePromise;
 }
 
+function adjustInflight(clientId: string, delta: number): void {
+  const inflight = inflightPerClient.get(clientId);
+  if (inflight !== undefined || delta > 0) {
+    inflightPerClient.set(clientId, (inflight ?? 0) + delta);
+  }
+  if (delta < 0) {
+    wakeClientWaiters();
+  }
+}
+
+// Every waiter re-checks for itself, so they are all woken at once
+function wakeClientWaiters(): void {
+  const waiters = [...clientWaiters];
+  clientWaiters.clear();
+  for (const wake of waiters) {
+    wake();
+  }
+}
+
+// Resolves when a client slot may have freed up or the deadline passes
+function waitForClientSlot(deadline: number): Promise<void> {
+  return new Promise((resolve) => {
+    const wake = () => {
+      clearTimeout(timer);
+      clientWaiters.delete(wake);
+      resolve();
+    };
+    const timer = setTimeout(wake, deadline - Date.now());
+    clientWaiters.add(wake);
+  });
+}
+
 function cleanupResponseQueue(requestId: string): void {
   const queue = responseQueues.get(requestId);
   if (queue) {
     clearTimeout(queue.timeout);
     responseQueues.delete(requestId);
+    adjustInflight(queue.clientId, -1);
   }
 }
 
-async function broadcastToClients(message: object): Promise<number> {
-  let successfulSend = 0;
-  const clientsToRemove: ElysiaWebSocket[] = [];
+function rejectResponseQueue(requestId: string, error: Error): void {
+  const queue = responseQueues.get(requestId);
+  if (queue) {
+    cleanupResponseQueue(requestId);
+    queue.reject(error);
+  }
+}
 
-  for (const client of clientList) {
+// Picks the connected client with the fewest requests in flight, skipping
+// clients that already have a request for every pooled tab
+function leastLoadedClient(): ElysiaWebSocket | undefined {
+  let selected: ElysiaWebSocket | undefined;
+  let selectedLoad = Infinity;
+
+  for (const client of clients.values()) {
+    const load = inflightPerClient.get(client.id) ?? 0;
+    const capacity = clientCapacity.get(client.id) ?? MAX_INFLIGHT_PER_CLIENT;
+    if (load < capacity && load < selectedLoad) {
+      selected = client;
+      selectedLoad = load;
+    }
+  }
+
+  return selected;
+}
+
+// Sends everything queued so far, one batch frame per client
+function flushPendingRequests(): void {
+  clearTimeout(batchTimer);
+  batchTimer = undefined;
+
+  const batches = [...pendingBatches];
+  pendingBatches.clear();
+
+  for (const [client, items] of batches) {
     try {
-      client.send(JSON.stringify(message));
-      successfulSend++;
+      // Bun reports a frame dropped on a closed connection as 0 bytes sent
+      if (client.send(JSON.stringify({ type: "batch", items })) === 0) {
+        throw new Error("Connection closed");
+      }
+      logger.debug(`Sent batch of ${items.length} requests to ${client.id}`);
     } catch (error) {
-      console.log("Error sending to client:", error);
-      clientsToRemove.push(client);
+      logger.warn("Error sending to client:", error);
+      clients.delete(client.id);
+      inflightPerClient.delete(client.id);
+      clientCapacity.delete(client.id);
+      wakeClientWaiters();
+      for (const item of items) {
+        rerouteRequest(item);
+      }
+    }
+  }
+}
+
+// Moves a request whose client could not be reached to the next least-loaded
+// client, waiting for a free slot; it only fails once no client is left or
+// the wait runs out
+async function rerouteRequest(request: OutgoingRequest): Promise<void> {
+  const deadline = Date.now() + CLIENT_WAIT_MS;
+  let client = leastLoadedClient();
+  while (!client) {
+    if (clients.size === 0 || Date.now() >= deadline) {
+      const reason =
+        clients.size === 0 ? "No client available" : "All clients are busy";
+      rejectResponseQueue(request.request_id, new Error(reason));
+      return;
     }
+    await waitForClientSlot(deadline);
+    client = leastLoadedClient();
+  }
+
+  // The request may have timed out while it waited
+  const queue = responseQueues.get(request.request_id);
+  if (!queue) {
+    return;
   }
 
-  // Remove failed clients
-  for (const client of clientsToRemove) {
-    removeClient(client);
+  adjustInflight(queue.clientId, -1);
+  queue.clientId = client.id;
+  adjustInflight(client.id, 1);
+  queueRequest(client, request);
+}
+
+function queueRequest(client: ElysiaWebSocket, request: OutgoingRequest): void {
+  let batch = pendingBatches.get(client);
+  if (!batch) {
+    batch = [];
+    pendingBatches.set(client, batch);
   }
+  batch.push(request);
 
-  return successfulSend;
+  if (batch.length >= MAX_BATCH_SIZE) {
+    flushPendingRequests();
+  } else if (!batchTimer) {
+    batchTimer = setTimeout(flushPendingRequests, BATCH_WINDOW_MS);
+  }
+}
+
+async function requestFromClients(message: {
+  type: string;
+  url: string;
+  [key: string]: any;
+}): Promise<ParsedMessage> {
+  // Requests already admitted by a semaphore wait for a slot rather than
+  // failing while every tab is busy; the slot is claimed in the same tick
+  // the client is picked, so concurrent waiters cannot overshoot it
+  const deadline = Date.now() + CLIENT_WAIT_MS;
+  let client = leastLoadedClient();
+  while (!client) {
+    if (clients.size === 0) {
+      throw new Error("No client available");
+    }
+    if (Date.now() >= deadline) {
+      throw new Error("All clients are busy");
+    }
+    await waitForClientSlot(deadline);
+    client = leastLoadedClient();
+  }
+
+  const requestId = generateUUID();
+  const responsePromise = createResponseQueue(requestId, client.id);
+
+  logger.debug(`Queueing ${message.type} for ${message.url} on ${client.id}`);
+  queueRequest(client, { ...message, request_id: requestId });
+
+  return responsePromise;
+}
+
+async function withPermit<T>(
+  semaphore: Semaphore,
+  task: () => Promise<T>,
+): Promise<T> {
+  await semaphore.acquire();
+  try {
+    return await task();
+  } finally {
+    semaphore.release();
+  }
 }
 
 // ========================================
-// Ensure Screenshots Directory Exists
+// Result Cache Keys
 // ========================================
 
-async function ensureScreenshotsDir(): Promise<void> {
+// Drops tracking parameters, and the fragment unless keepFragment is set, so
+// URLs that render the same page share one cache entry. Hash-router
+// fragments (#/ and #!) select a different page and are always kept.
+function cacheKeyForUrl(url: string, keepFragment: boolean = false): string {
+  let parsed: URL;
+  try {
+    parsed = new URL(url);
+  } catch {
+    return url;
+  }
+
+  const isRoute = parsed.hash.startsWith("#/") || parsed.hash.startsWith("#!");
+  if (!keepFragment && !isRoute) {
+    parsed.hash = "";
+  }
+  for (const name of [...parsed.searchParams.keys()]) {
+    if (name.startsWith("utm_") || TRACKING_PARAMS.has(name)) {
+      parsed.searchParams.delete(name);
+    }
+  }
+
+  return parsed.toString();
+}
+
+// Pages loaded with subresources allowed can render different HTML, so they
+// get their own cache entries
+function fetchCacheKey(url: string, blockResources: boolean): string {
+  const key = cacheKeyForUrl(url);
+  return blockResources ? key : `full|${key}`;
+}
+
+// Concurrent requests for the same URL share a single extraction
+function fetchFromClients(
+  url: string,
+  blockResources: boolean,
+): Promise<ParsedMessage> {
+  const cacheKey = fetchCacheKey(url, blockResources);
+  let pending = inflightFetches.get(cacheKey);
+
+  if (!pending) {
+    pending = withPermit(fetchSemaphore, () =>
+      requestFromClients({
+        type: "extractHtml",
+        url,
+        block_resources: blockResources,
+      }),
+    )
+      .then((parsedData) => {
+        if (parsedData.result && !parsedData.result.error) {
+          fetchCache.set(cacheKey, parsedData.result);
+        }
+        return parsedData;
+      })
+      .finally(() => {
+        inflightFetches.delete(cacheKey);
+      });
+    inflightFetches.set(cacheKey, pending);
+  }
+
+  return pending;
+}
+
+async function fetchHtml(
+  url: string,
+  forceRefresh: boolean,
+  blockResources: boolean,
+): Promise<ParsedMessage["result"]> {
+  const cached = forceRefresh
+    ? undefined
+    : fetchCache.get(fetchCacheKey(url, blockResources));
+  return cached ?? (await fetchFromClients(url, blockResources)).result;
+}
+
+// Writes to a temporary name and renames it into place, so readers only ever
+// see a complete file
+async function writeFileAtomically(
+  filepath: string,
+  data: Uint8Array,
+): Promise<void> {
+  const tempPath = `${filepath}.${generateUUID()}.tmp`;
   try {
-    await Bun.write(join(SCREENSHOTS_DIR, ".gitkeep"), "");
-  } catch (error) {
-    // Directory might already exist, that's fine
+    await Bun.write(tempPath, data);
+    await rename(tempPath, filepath);
+  } catch (e) {
+    await rm(tempPath, { force: true });
+    throw e;
+  }
+}
+
+// Stats every screenshot concurrently instead of one after another. Files
+// deleted between the scan and their stat, e.g. by an eviction sweep, are
+// skipped.
+async function statScreenshots(): Promise<ScreenshotFile[]> {
+  const glob = new Bun.Glob("*.{png,jpg}");
+  const filenames = await Array.fromAsync(glob.scan(SCREENSHOTS_DIR));
+
+  const entries = await Promise.all(
+    filenames.map(async (filename): Promise<ScreenshotFile | undefined> => {
+      try {
+        const stats = await Bun.file(join(SCREENSHOTS_DIR, filename)).stat();
+        return { filename, created: stats.ctime.getTime(), size: stats.size };
+      } catch (e) {
+        if ((e as NodeJS.ErrnoException).code === "ENOENT") {
+          return undefined;
+        }
+        throw e;
+      }
+    }),
+  );
+  return entries.filter((entry): entry is ScreenshotFile => !!entry);
+}
+
+// Deletes the oldest screenshots until the directory fits within
+// SCREENSHOTS_MAX_BYTES
+async function enforceScreenshotsCap(): Promise<void> {
+  const entries = await statScreenshots();
+  let totalBytes = entries.reduce((sum, entry) => sum + entry.size, 0);
+  if (totalBytes <= SCREENSHOTS_MAX_BYTES) {
+    return;
+  }
+
+  entries.sort((a, b) => a.created - b.created);
+  for (const entry of entries) {
+    if (totalBytes <= SCREENSHOTS_MAX_BYTES) {
+      break;
+    }
+    await rm(join(SCREENSHOTS_DIR, entry.filename), { force: true });
+    totalBytes -= entry.size;
+    logger.debug(`Evicted screenshot ${entry.filename}`);
+  }
+}
+
+// Writes that finish while a sweep is running share it; the next write
+// sweeps again
+function sweepScreenshots(): Promise<void> {
+  screenshotsSweep ??= enforceScreenshotsCap()
+    .catch((e) => {
+      logger.error("Failed to enforce the screenshots size cap:", e);
+    })
+    .finally(() => {
+      screenshotsSweep = undefined;
+    });
+  return screenshotsSweep;
+}
+
+// Concurrent requests for the same page and format share a single capture
+// and a single write of its file
+function captureScreenshot(
+  url: string,
+  format: string,
+  cacheKey: string,
+  filename: string,
+  filepath: string,
+): Promise<CapturedScreenshot> {
+  let pending = inflightScreenshots.get(cacheKey);
+
+  if (!pending) {
+    pending = withPermit(screenshotSemaphore, () =>
+      requestFromClients({ type: "captureScreenshot", url, format }),
+    )
+      .then((parsedData): CapturedScreenshot => {
+        const result = parsedData.result || {};
+        const finalUrl = result.url || url;
+
+        if (result.error || !result.screenshot) {
+          return {
+            error: result.error,
+            url: finalUrl,
+            saved: Promise.resolve(false),
+          };
+        }
+
+        const bytes = screenshotBytes(result.screenshot);
+        const saved = writeFileAtomically(filepath, bytes)
+          .then(() => {
+            sweepScreenshots();
+            screenshotCache.set(cacheKey, {
+              filename,
+              filepath,
+              url: finalUrl,
+            });
+            return true;
+          })
+          .catch((e) => {
+            logger.error("Failed to save screenshot:", e);
+            return false;
+          });
+
+        return { bytes, url: finalUrl, saved };
+      })
+      .finally(() => {
+        inflightScreenshots.delete(cacheKey);
+      });
+    inflightScreenshots.set(cacheKey, pending);
   }
+
+  return pending;
 }
 
-ensureScreenshotsDir();
+// ========================================
+// Ensure Screenshots Directory Exists
+// ========================================
+
+// recursive also makes this a no-op when the directory already exists, so
+// concurrent starts cannot race each other
+await mkdir(SCREENSHOTS_DIR, { recursive: true });
 
 // ========================================
 // Elysia App
@@ -145,14 +817,47 @@ const app = new Elysia()
   // ========================================
   .ws("/ws", {
     open(ws) {
-      console.log("WebSocket client connected");
-      clientList.push(ws);
+      logger.info("WebSocket client connected");
+      clients.set(ws.id, ws);
+      wakeClientWaiters();
+      if (NETWORK_IDLE_MS !== undefined) {
+        ws.send(
+          JSON.stringify({
+            type: "configure",
+            network_idle_ms: NETWORK_IDLE_MS,
+          }),
+        );
+      }
+      if (HOT_DOMAINS.length > 0) {
+        ws.send(JSON.stringify({ type: "warmHosts", hosts: HOT_DOMAINS }));
+      }
     },
 
     message(ws, message) {
       try {
         const parsedData: ParsedMessage =
-          typeof message === "string" ? JSON.parse(message) : message;
+          message instanceof Uint8Array
+            ? parseBinaryMessage(message)
+            : typeof message === "string"
+              ? JSON.parse(message)
+              : message;
+
+        if (parsedData.type === "register") {
+          const poolSize = parsedData.pool_size;
+          if (Number.isInteger(poolSize) && poolSize > 0) {
+            clientCapacity.set(ws.id, poolSize);
+            wakeClientWaiters();
+            logger.info(`Client ${ws.id} has ${poolSize} pooled tabs`);
+          }
+          return;
+        }
+
+        if (parsedData.type === "ping") {
+          ws.send(
+            JSON.stringify({ type: "pong", timestamp: parsedData.timestamp }),
+          );
+          return;
+        }
 
         if (parsedData.request_id) {
           const requestId = parsedData.request_id;
@@ -164,58 +869,140 @@ const app = new Elysia()
           }
         }
       } catch (e) {
-        console.error("Error processing WebSocket message:", e);
+        logger.error("Error processing WebSocket message:", e);
       }
     },
 
     close(ws) {
-      console.log("WebSocket client disconnected");
-      removeClient(ws);
+      logger.info("WebSocket client disconnected");
+      clients.delete(ws.id);
+
+      // Requests routed to this client will never be answered
+      for (const [requestId, queue] of responseQueues) {
+        if (queue.clientId === ws.id) {
+          rejectResponseQueue(requestId, new Error("Client disconnected"));
+        }
+      }
+      inflightPerClient.delete(ws.id);
+      clientCapacity.delete(ws.id);
+      // Waiters fail fast once the last client is gone
+      wakeClientWaiters();
     },
   })
 
   // ========================================
   // POST /fetch - Extract HTML data
   // ========================================
-  .post("/fetch", async ({ body, set }) => {
-    console.log("Extracting data");
+  .post("/fetch", async ({ body, set, request }) => {
+    logger.debug("Extracting data");
 
-    const { url } = body as { url: string };
+    const {
+      url,
+      raw = false,
+      force_refresh = false,
+      block_resources = true,
+    } = body as {
+      url: string;
+      raw?: boolean;
+      force_refresh?: boolean;
+      block_resources?: boolean;
+    };
 
     if (!url) {
       set.status = 400;
       return { error: "URL is required" };
     }
 
-    const requestId = generateUUID();
-    const responsePromise = createResponseQueue(requestId);
+    try {
+      const result = await fetchHtml(url, force_refresh, block_resources);
 
-    console.log("Sending to clients");
-    const successfulSend = await broadcastToClients({
-      type: "extractHtml",
-      url,
-      request_id: requestId,
-    });
+      if (result?.error) {
+        set.status = 502;
+        return { error: result.error, url };
+      }
 
-    console.log(`Successfully sent to ${successfulSend} clients`);
+      // Raw mode sends the HTML as the body and skips JSON-escaping it
+      if (raw && typeof result?.html === "string") {
+        return await compressibleResponse(request, result.html, {
+          "Content-Type": "text/html; charset=utf-8",
+          "X-Final-URL": result.url || url,
+          "X-Status-Code": String(result.status_code ?? 200),
+          "X-Truncated": String(Boolean(result.truncated)),
+        });
+      }
 
-    if (successfulSend === 0) {
-      cleanupResponseQueue(requestId);
+      return await compressibleResponse(request, JSON.stringify(result), {
+        "Content-Type": "application/json",
+      });
+    } catch (error) {
+      if (error instanceof Error && error.message === "No client available") {
+        set.status = 500;
+        return { error: "No client available" };
+      }
+      if (error instanceof Error && error.message === "All clients are busy") {
+        set.status = 503;
+        return { error: "All clients are busy" };
+      }
+      if (error instanceof Error && error.message === "Request timed out") {
+        set.status = 504;
+        return { error: "Request timed out" };
+      }
+      logger.error("Failed to fetch HTML:", error);
       set.status = 500;
-      return { error: "No client available" };
+      return { error: `Failed to fetch HTML: ${errorMessage(error)}`, url };
+    }
+  })
+
+  // ========================================
+  // POST /fetch_batch - Extract HTML for several URLs
+  // ========================================
+  .post("/fetch_batch", async ({ body, set, request }) => {
+    const {
+      urls,
+      force_refresh = false,
+      block_resources = true,
+    } = body as {
+      urls: string[];
+      force_refresh?: boolean;
+      block_resources?: boolean;
+    };
+
+    if (!Array.isArray(urls) || urls.length === 0) {
+      set.status = 400;
+      return { error: "URLs are required" };
+    }
+
+    if (urls.length > MAX_BATCH_URLS) {
+      set.status = 400;
+      return { error: `At most ${MAX_BATCH_URLS} URLs per batch` };
     }
 
-    console.log(`Waiting for data for request ${requestId}`);
+    logger.debug(`Extracting data for ${urls.length} URLs`);
+
+    // Results keep the order of the requested URLs; failures are reported
+    // per URL instead of failing the whole batch
+    const results = await Promise.all(
+      urls.map(async (url: unknown) => {
+        if (typeof url !== "string" || !url) {
+          return { error: "URL is required", url };
+        }
+        try {
+          const result = await fetchHtml(url, force_refresh, block_resources);
+          return result?.error ? { error: result.error, url } : result;
+        } catch (error) {
+          return { error: errorMessage(error), url };
+        }
+      }),
+    );
 
     try {
-      const parsedData = await responsePromise;
-      return parsedData.result;
+      return await compressibleResponse(request, JSON.stringify(results), {
+        "Content-Type": "application/json",
+      });
     } catch (error) {
-      if (error instanceof Error && error.message === "Request timed out") {
-        set.status = 504;
-        return { error: "Request timed out" };
-      }
-      throw error;
+      logger.error("Failed to send batch results:", error);
+      set.status = 500;
+      return { error: `Failed to send batch results: ${errorMessage(error)}` };
     }
   })
 
@@ -223,89 +1010,123 @@ const app = new Elysia()
   // POST /screenshot - Capture screenshot
   // ========================================
   .post("/screenshot", async ({ body, set }) => {
-    console.log("Taking screenshot");
+    logger.debug("Taking screenshot");
 
-    const { url } = body as { url: string };
+    const {
+      url,
+      format = DEFAULT_SCREENSHOT_FORMAT,
+      force_refresh = false,
+      inline = false,
+    } = body as {
+      url: string;
+      format?: string;
+      force_refresh?: boolean;
+      inline?: boolean;
+    };
 
     if (!url) {
       set.status = 400;
       return { error: "URL is required" };
     }
 
-    const requestId = generateUUID();
-    const responsePromise = createResponseQueue(requestId);
-
-    console.log("Sending screenshot request to clients");
-    const successfulSend = await broadcastToClients({
-      type: "captureScreenshot",
-      url,
-      request_id: requestId,
-    });
+    const extension = SCREENSHOT_EXTENSIONS.get(format);
+    if (!extension) {
+      set.status = 400;
+      return { error: `Unsupported screenshot format: ${format}` };
+    }
 
-    console.log(`Successfully sent to ${successfulSend} clients`);
+    // Any fragment can scroll the viewport and change the captured image
+    const cacheKey = `${format}|${cacheKeyForUrl(url, true)}`;
+    const filename = screenshotFilename(cacheKey, extension);
+    const filepath = join(SCREENSHOTS_DIR, filename);
+    let cached = force_refresh ? undefined : screenshotCache.get(cacheKey);
 
-    if (successfulSend === 0) {
-      cleanupResponseQueue(requestId);
-      set.status = 500;
-      return { error: "No client available" };
+    if (!cached && !force_refresh && (await isFreshOnDisk(filepath))) {
+      cached = { filename, filepath, url };
+      screenshotCache.set(cacheKey, cached);
     }
 
-    console.log(`Waiting for screenshot data for request ${requestId}`);
+    if (cached) {
+      const file = Bun.file(cached.filepath);
+      if (await file.exists()) {
+        if (inline) {
+          return new Response(file, {
+            headers: inlineScreenshotHeaders(format, cached.url),
+          });
+        }
+        return {
+          success: true,
+          screenshot_path: cached.filepath,
+          filename: cached.filename,
+          url: cached.url,
+          cached: true,
+        };
+      }
+      screenshotCache.delete(cacheKey);
+    }
 
     try {
-      const parsedData = await responsePromise;
-      const result = parsedData.result || {};
+      const capture = await captureScreenshot(
+        url,
+        format,
+        cacheKey,
+        filename,
+        filepath,
+      );
+
+      if (capture.error) {
+        set.status = 502;
+        return { error: capture.error, url };
+      }
 
-      if (!result.screenshot) {
+      if (!capture.bytes) {
         set.status = 500;
         return { error: "No screenshot data received" };
       }
 
-      // Generate filename
-      const timestamp = createTimestamp();
-      const filename = `screenshot_${timestamp}_${requestId.slice(0, 8)}.png`;
-      const filepath = join(SCREENSHOTS_DIR, filename);
-
-      try {
-        // Remove data:image/png;base64, prefix if present
-        let imageData = result.screenshot;
-        if (imageData.startsWith("data:image")) {
-          imageData = imageData.split(",")[1];
-        }
-
-        // Decode base64 and save
-        const buffer = Buffer.from(imageData, "base64");
-        await Bun.write(filepath, buffer);
+      // Inline mode hands the image straight back while the file is still
+      // being written for later requests
+      if (inline) {
+        return new Response(capture.bytes, {
+          headers: inlineScreenshotHeaders(format, capture.url),
+        });
+      }
 
-        return {
-          success: true,
-          screenshot_path: filepath,
-          filename,
-          url: result.url || url,
-        };
-      } catch (e) {
-        console.error("Failed to save screenshot:", e);
+      // The path is only handed out once the file exists in full
+      if (!(await capture.saved)) {
         set.status = 500;
-        return {
-          error: `Failed to save screenshot: ${e instanceof Error ? e.message : String(e)}`,
-        };
+        return { error: "Failed to save screenshot" };
       }
+
+      return {
+        success: true,
+        screenshot_path: filepath,
+        filename,
+        url: capture.url,
+      };
     } catch (error) {
-      if (
-        error instanceof Error &&
-        error.message === "Screenshot request timed out"
-      ) {
+      if (error instanceof Error && error.message === "No client available") {
+        set.status = 500;
+        return { error: "No client available" };
+      }
+      if (error instanceof Error && error.message === "All clients are busy") {
+        set.status = 503;
+        return { error: "All clients are busy" };
+      }
+      if (error instanceof Error && error.message === "Request timed out") {
         set.status = 504;
         return { error: "Screenshot request timed out" };
       }
-      throw error;
+      logger.error("Failed to capture screenshot:", error);
+      set.status = 500;
+      return { error: `Failed to capture screenshot: ${errorMessage(error)}` };
     }
   })
 
   // ========================================
   // GET /screenshot/:filename - Get screenshot file
   // ========================================
-  .get("/screenshot/:filename", async ({ params, set }) => {
+  .get("/screenshot/:filename", async ({ params, set, request }) => {
     const { filename } = params;
 
     try {
@@ -317,12 +1138,34 @@ const app = new Elysia()
         return { error: "Screenshot not found" };
       }
 
+      // A refreshed capture rewrites the same filename, so clients
+      // revalidate against these validators on every request
+      const stats = await file.stat();
+      const modifiedAt = stats.mtime.getTime();
+      const etag = `"${stats.size.toString(16)}-${modifiedAt.toString(16)}"`;
+
+      set.headers["Cache-Control"] = SCREENSHOT_CACHE_CONTROL;
+      set.headers["ETag"] = etag;
+      set.headers["Last-Modified"] = stats.mtime.toUTCString();
+
+      const ifNoneMatch = request.headers.get("If-None-Match");
+      const ifModifiedSince = request.headers.get("If-Modified-Since");
+      const notModified = ifNoneMatch
+        ? ifNoneMatch === etag
+        : ifModifiedSince !== null &&
+          Math.floor(modifiedAt / 1000) <= Date.parse(ifModifiedSince) / 1000;
+
+      if (notModified) {
+        set.status = 304;
+        return "";
+      }
+
       return file;
     } catch (e) {
-      console.error("Failed to retrieve screenshot:", e);
+      logger.error("Failed to retrieve screenshot:", e);
       set.status = 500;
       return {
-        error: `Failed to retrieve screenshot: ${e instanceof Error ? e.message : String(e)}`,
+        error: `Failed to retrieve screenshot: ${errorMessage(e)}`,
       };
     }
   })
@@ -338,38 +1181,29 @@ const app = new Elysia()
         return { screenshots: [] };
       }
 
-      const glob = new Bun.Glob("*.png");
-      const screenshots = [];
+      const entries = await statScreenshots();
 
-      for await (const filename of glob.scan(SCREENSHOTS_DIR)) {
-        const filepath = join(SCREENSHOTS_DIR, filename);
-        const file = Bun.file(filepath);
-        const stats = await file.stat();
+      // Sort by creation time, newest first, before formatting any dates
+      entries.sort((a, b) => b.created - a.created);
 
-        screenshots.push({
-          filename,
-          created: stats.ctime.toISOString(),
-          size: stats.size,
-        });
-      }
-
-      // Sort by creation time, newest first
-      screenshots.sort((a, b) => {
-        return new Date(b.created).getTime() - new Date(a.created).getTime();
-      });
+      const screenshots = entries.map(({ filename, created, size }) => ({
+        filename,
+        created: new Date(created).toISOString(),
+        size,
+      }));
 
       return { screenshots };
     } catch (e) {
-      console.error("Failed to list screenshots:", e);
+      logger.error("Failed to list screenshots:", e);
       set.status = 500;
       return {
-        error: `Failed to list screenshots: ${e instanceof Error ? e.message : String(e)}`,
+        error: `Failed to list screenshots: ${errorMessage(e)}`,
       };
     }
   })
 
   .listen(PORT);
 
-console.log(
+logger.info(
   `🦊 Elysia is running at ${app.server?.hostname}:${app.server?.port}`,
 );
@@ -1,220 +1,553 @@
-const extractHtml = async (url: string, maxTimeout: number = 30000) => {
-  const waitForPageLoad = () => {
-    return new Promise((resolve) => {
-      if (document.readyState === "complete") {
-        resolve(null);
-      } else {
-        const listener = () => {
-          if (document.readyState === "complete") {
-            document.removeEventListener("readystatechange", listener);
-            resolve(null);
-          }
-        };
-        document.addEventListener("readystatechange", listener);
-      }
+const NETWORK_IDLE_MS = 500;
+const DOM_QUIET_MS = 500;
+// The server may override the idle window when the extension connects
+let networkIdleMs = NETWORK_IDLE_MS;
+const PAGE_READY_TIMEOUT_MS = 15000;
+
+// Request types that count towards network idle. WebSockets, beacons and CSP
+// reports can stay open or fire indefinitely and would keep a page "busy"
+// until the ceiling, so they are not tracked.
+const TRACKED_REQUEST_TYPES: chrome.webRequest.ResourceType[] = [
+  "main_frame",
+  "sub_frame",
+  "stylesheet",
+  "script",
+  "image",
+  "font",
+  "object",
+  "xmlhttprequest",
+  "media",
+  "other",
+];
+
+// Injected into the page: resolves once the DOM has gone quietMs without a
+// mutation anywhere in the document, or after maxMs.
+const waitForDomQuiet = (quietMs: number, maxMs: number) => {
+  return new Promise<void>((resolve) => {
+    const done = () => {
+      observer.disconnect();
+      clearTimeout(quietTimer);
+      clearTimeout(maxTimer);
+      resolve();
+    };
+
+    const observer = new MutationObserver(() => {
+      clearTimeout(quietTimer);
+      quietTimer = setTimeout(done, quietMs);
     });
-  };
 
-  const getStatusCode = (originalUrl: string) => {
-    return new Promise((resolve) => {
-      const currentUrl = window.location.href;
-      if (currentUrl !== originalUrl) {
-        resolve(301);
+    let quietTimer = setTimeout(done, quietMs);
+    const maxTimer = setTimeout(done, maxMs);
+
+    observer.observe(document.documentElement, {
+      childList: true,
+      subtree: true,
+    });
+  });
+};
+
+// Resolves once the tab has fired its load event, no network requests have
+// been in flight for networkIdleMs and the DOM has stopped mutating, or
+// after PAGE_READY_TIMEOUT_MS.
+const waitForPageReady = (tabId: number) => {
+  return new Promise<void>((resolve) => {
+    const inflight = new Set<string>();
+    const filter = {
+      urls: ["<all_urls>"],
+      types: TRACKED_REQUEST_TYPES,
+      tabId,
+    };
+    let loaded = false;
+    let networkIdle = false;
+    let domQuiet = false;
+    let idleTimer: NodeJS.Timeout | undefined;
+
+    const finish = () => {
+      clearTimeout(idleTimer);
+      clearTimeout(deadline);
+      chrome.webRequest.onBeforeRequest.removeListener(onRequest);
+      chrome.webRequest.onCompleted.removeListener(onRequestDone);
+      chrome.webRequest.onErrorOccurred.removeListener(onRequestDone);
+      chrome.tabs.onUpdated.removeListener(onUpdated);
+      resolve();
+    };
+
+    const maybeFinish = () => {
+      if (networkIdle && domQuiet) {
+        finish();
       }
-      const entries: any = window.performance.getEntries();
-      if (entries.length > 0) {
-        resolve(entries[0].responseStatus || 200);
-      } else {
-        resolve(200);
+    };
+
+    const checkIdle = () => {
+      clearTimeout(idleTimer);
+      networkIdle = false;
+      if (loaded && inflight.size === 0) {
+        idleTimer = setTimeout(() => {
+          networkIdle = true;
+          maybeFinish();
+        }, networkIdleMs);
       }
-    });
-  };
+    };
 
-  console.log(`Processing: ${url}`);
+    const markLoaded = () => {
+      if (loaded) {
+        return;
+      }
+      loaded = true;
+      checkIdle();
 
-  let createdTab: chrome.tabs.Tab | undefined;
-  let timeoutId: NodeJS.Timeout | undefined;
+      const onDomQuiet = () => {
+        domQuiet = true;
+        maybeFinish();
+      };
+      chrome.scripting
+        .executeScript({
+          target: { tabId },
+          func: waitForDomQuiet,
+          args: [DOM_QUIET_MS, PAGE_READY_TIMEOUT_MS],
+        })
+        .then(onDomQuiet, onDomQuiet);
+    };
 
-  try {
-    const timeoutPromise = new Promise((_, reject) => {
-      timeoutId = setTimeout(() => {
-        reject(new Error(`Operation timed out after ${maxTimeout}ms`));
-      }, maxTimeout);
-    });
+    const onRequest = (details: { requestId: string }) => {
+      inflight.add(details.requestId);
+      clearTimeout(idleTimer);
+      networkIdle = false;
+    };
 
-    const extractPromise = async () => {
-      const tab = await chrome.tabs.create({ url });
-      createdTab = tab;
+    const onRequestDone = (details: { requestId: string }) => {
+      inflight.delete(details.requestId);
+      checkIdle();
+    };
 
-      if (!tab.id) {
-        throw new Error("Failed to create tab");
+    const onUpdated = (
+      updatedTabId: number,
+      changeInfo: chrome.tabs.TabChangeInfo,
+      tab: chrome.tabs.Tab
+    ) => {
+      if (
+        updatedTabId === tabId &&
+        changeInfo.status === "complete" &&
+        tab.url !== BLANK_URL
+      ) {
+        markLoaded();
       }
+    };
 
-      await Promise.race([
-        chrome.scripting.executeScript({
-          target: { tabId: tab.id },
-          func: waitForPageLoad,
-        }),
-        new Promise((resolve) => setTimeout(() => resolve(null), 10000)),
-      ]);
+    const deadline = setTimeout(finish, PAGE_READY_TIMEOUT_MS);
 
-      await new Promise((resolve) => setTimeout(resolve, 3000));
+    chrome.webRequest.onBeforeRequest.addListener(onRequest, filter);
+    chrome.webRequest.onCompleted.addListener(onRequestDone, filter);
+    chrome.webRequest.onErrorOccurred.addListener(onRequestDone, filter);
+    chrome.tabs.onUpdated.addListener(onUpdated);
 
-      const html = await chrome.scripting.executeScript({
-        target: { tabId: tab.id },
-        func: () => document.documentElement.outerHTML,
-      });
+    // The load event may have fired before the listeners were attached.
+    chrome.tabs.get(tabId).then((tab) => {
+      if (tab.status === "complete" && tab.url !== BLANK_URL) {
+        markLoaded();
+      }
+    }, finish);
+  });
+};
 
-      const statusCode = await chrome.scripting.executeScript({
-        target: { tabId: tab.id },
-        func: getStatusCode,
-        args: [url],
-      });
+const BLANK_URL = "about:blank";
+const TAB_POOL_SIZE = Math.max(2, Math.min(navigator.hardwareConcurrency, 4));
+const TAB_POOL_STORAGE_KEY = "tabPool";
+const TAB_POOL_SIZE_SETTING = "tabPoolSize";
+
+// Keeps a fixed set of idle tabs that are navigated in place instead of
+// creating and closing a tab for every request. Each tab lives in its own
+// window so it stays the active, unthrottled tab there and any tab can be
+// captured without switching tabs; the captures themselves are still rate
+// limited, see waitForCaptureSlot. Tab ids are persisted in session storage
+// so a restarted service worker picks its tabs back up.
+class TabPool {
+  size: number;
+  members: Set<number>;
+  idleTabs: number[];
+  waiters: ((tabId: number) => void)[];
+  ready: Promise<void>;
+
+  constructor(size: number) {
+    this.size = size;
+    this.members = new Set();
+    this.idleTabs = [];
+    this.waiters = [];
+    this.ready = this.fill();
+  }
 
-      const currentUrl = await chrome.scripting.executeScript({
-        target: { tabId: tab.id },
-        func: () => window.location.href,
-      });
+  async fill() {
+    // The pool size can be overridden from chrome.storage.local
+    const settings = await chrome.storage.local.get(TAB_POOL_SIZE_SETTING);
+    const configuredSize = settings[TAB_POOL_SIZE_SETTING];
+    if (Number.isInteger(configuredSize) && configuredSize > 0) {
+      this.size = configuredSize;
+    }
 
-      return {
-        html: html[0].result,
-        status_code: statusCode[0].result,
-        url: currentUrl[0].result,
-      };
-    };
+    const stored = await chrome.storage.session.get(TAB_POOL_STORAGE_KEY);
+    const storedIds: number[] = stored[TAB_POOL_STORAGE_KEY] || [];
 
-    const result = await Promise.race([extractPromise(), timeoutPromise]);
-    return result;
-  } catch (error) {
-    console.error(`Error extracting HTML from ${url}:`, error);
-    throw error;
-  } finally {
-    if (timeoutId) {
-      clearTimeout(timeoutId);
+    // Session rules outlive the service worker, so a tab adopted mid-extraction
+    // would otherwise keep blocking its subresources
+    await chrome.declarativeNetRequest
+      .updateSessionRules({ removeRuleIds: storedIds })
+      .catch((error) => {
+        console.error("Failed to clear stale block rules:", error);
+      });
+
+    for (const tabId of storedIds.slice(0, this.size)) {
+      try {
+        await chrome.tabs.update(tabId, { url: BLANK_URL });
+        this.members.add(tabId);
+        this.idleTabs.push(tabId);
+      } catch (error) {
+        console.log(`Pooled tab ${tabId} no longer exists`);
+      }
     }
-    if (createdTab?.id) {
-      const tabId = createdTab.id;
+
+    // Tabs left over from a larger pool would otherwise be orphaned windows
+    for (const tabId of storedIds.slice(this.size)) {
       try {
         await chrome.tabs.remove(tabId);
-        console.log(`Tab ${tabId} closed successfully`);
-      } catch (removeError) {
-        console.error(`Failed to close tab ${tabId}:`, removeError);
-        try {
-          const existingTab = await chrome.tabs.get(tabId);
-          if (existingTab) {
-            await chrome.tabs.remove(tabId);
-          }
-        } catch (retryError) {
-          console.error(`Retry failed to close tab ${tabId}:`, retryError);
-        }
+      } catch (error) {
+        console.log(`Pooled tab ${tabId} was already closed`);
       }
     }
+
+    while (this.idleTabs.length < this.size) {
+      this.idleTabs.push(await this.createTab());
+    }
+
+    await this.persist();
+    console.log(`Tab pool ready with ${this.idleTabs.length} tabs`);
   }
-};
 
-const captureScreenshot = async (url: string, maxTimeout: number = 30000) => {
-  const waitForPageLoad = () => {
-    return new Promise((resolve) => {
-      if (document.readyState === "complete") {
-        resolve(null);
-      } else {
-        const listener = () => {
-          if (document.readyState === "complete") {
-            document.removeEventListener("readystatechange", listener);
-            resolve(null);
-          }
-        };
-        document.addEventListener("readystatechange", listener);
-      }
+  async createTab() {
+    const createdWindow = await chrome.windows.create({
+      url: BLANK_URL,
+      focused: false,
     });
-  };
-
-  console.log(`Capturing screenshot for: ${url}`);
+    const tab = createdWindow?.tabs?.[0];
+    if (!tab?.id) {
+      throw new Error("Failed to create tab");
+    }
+    // Pool tabs never need to produce sound
+    await chrome.tabs.update(tab.id, { muted: true });
+    this.members.add(tab.id);
+    await this.persist();
+    return tab.id;
+  }
 
-  let createdTab: chrome.tabs.Tab | undefined;
-  let timeoutId: NodeJS.Timeout | undefined;
+  async replaceTab(tabId: number) {
+    this.members.delete(tabId);
+    return this.createTab();
+  }
 
-  try {
-    const timeoutPromise = new Promise((_, reject) => {
-      timeoutId = setTimeout(() => {
-        reject(new Error(`Operation timed out after ${maxTimeout}ms`));
-      }, maxTimeout);
+  async persist() {
+    await chrome.storage.session.set({
+      [TAB_POOL_STORAGE_KEY]: [...this.members],
     });
+  }
 
-    const capturePromise = async () => {
-      const tab = await chrome.tabs.create({ url });
-      createdTab = tab;
+  async acquire(): Promise<number> {
+    await this.ready;
 
-      if (!tab.id) {
-        throw new Error("Failed to create tab");
-      }
+    const tabId = this.idleTabs.pop();
+    if (tabId === undefined) {
+      return new Promise((resolve) => this.waiters.push(resolve));
+    }
 
-      await Promise.race([
-        chrome.scripting.executeScript({
-          target: { tabId: tab.id },
-          func: waitForPageLoad,
-        }),
-        new Promise((resolve) => setTimeout(() => resolve(null), 10000)),
-      ]);
+    try {
+      await chrome.tabs.get(tabId);
+      return tabId;
+    } catch (error) {
+      console.log(`Pooled tab ${tabId} was closed, replacing it`);
+      return this.replaceTab(tabId);
+    }
+  }
+
+  async release(tabId: number) {
+    try {
+      await chrome.tabs.update(tabId, { url: BLANK_URL });
+    } catch (error) {
+      console.error(`Failed to reset tab ${tabId}, replacing it:`, error);
+      tabId = await this.replaceTab(tabId);
+    }
 
-      await new Promise((resolve) => setTimeout(resolve, 3000));
+    this.handOver(tabId);
+  }
 
-      const screenshot = await chrome.tabs.captureVisibleTab(tab.windowId, {
-        format: "png",
-        quality: 90,
-      });
+  // A tab whose request failed may be stuck mid-navigation or on a crashed
+  // renderer, so it is closed and a fresh one takes its place
+  async discard(tabId: number) {
+    try {
+      await chrome.tabs.remove(tabId);
+    } catch (error) {
+      console.log(`Pooled tab ${tabId} was already closed`);
+    }
+
+    this.handOver(await this.replaceTab(tabId));
+  }
 
-      const currentUrl = await chrome.scripting.executeScript({
-        target: { tabId: tab.id },
-        func: () => window.location.href,
+  handOver(tabId: number) {
+    const waiter = this.waiters.shift();
+    if (waiter) {
+      waiter(tabId);
+    } else {
+      this.idleTabs.push(tabId);
+    }
+  }
+}
+
+const tabPool = new TabPool(TAB_POOL_SIZE);
+
+const BLOCKED_RESOURCE_TYPES = [
+  chrome.declarativeNetRequest.ResourceType.IMAGE,
+  chrome.declarativeNetRequest.ResourceType.FONT,
+  chrome.declarativeNetRequest.ResourceType.MEDIA,
+];
+
+// Session rules are keyed by tab id so each pooled tab owns at most one.
+const blockSubresources = (tabId: number) => {
+  return chrome.declarativeNetRequest.updateSessionRules({
+    removeRuleIds: [tabId],
+    addRules: [
+      {
+        id: tabId,
+        priority: 1,
+        action: { type: chrome.declarativeNetRequest.RuleActionType.BLOCK },
+        condition: { tabIds: [tabId], resourceTypes: BLOCKED_RESOURCE_TYPES },
+      },
+    ],
+  });
+};
+
+const unblockSubresources = (tabId: number) => {
+  return chrome.declarativeNetRequest.updateSessionRules({
+    removeRuleIds: [tabId],
+  });
+};
+
+// Rejects when the task has not settled within ms; the timer never outlives
+// the task
+const withTimeout = async <T>(task: Promise<T>, ms: number): Promise<T> => {
+  let timeoutId: NodeJS.Timeout | undefined;
+  const timeout = new Promise<never>((_, reject) => {
+    timeoutId = setTimeout(() => {
+      reject(new Error(`Operation timed out after ${ms}ms`));
+    }, ms);
+  });
+
+  try {
+    return await Promise.race([task, timeout]);
+  } finally {
+    clearTimeout(timeoutId);
+  }
+};
+
+// Hands a tab back to the pool in the background so the reset navigation
+// does not delay the response
+const recycleTab = (
+  tabId: number,
+  failed: boolean,
+  unblock: boolean = false
+) => {
+  const recycle = async () => {
+    if (unblock) {
+      await unblockSubresources(tabId).catch((error) => {
+        console.error(`Failed to unblock tab ${tabId}:`, error);
       });
+    }
+    if (failed) {
+      await tabPool.discard(tabId);
+    } else {
+      await tabPool.release(tabId);
+    }
+  };
 
-      return {
-        screenshot: screenshot,
-        url: currentUrl[0].result,
-      };
-    };
+  recycle().catch((error) => {
+    console.error(`Failed to return tab ${tabId} to the pool:`, error);
+  });
+};
 
-    const result = await Promise.race([capturePromise(), timeoutPromise]);
-    return result;
+// Runs work on a pooled tab under a timeout. The tab goes back to the pool
+// once the work has actually finished, or is replaced when it failed.
+const withPooledTab = async <T>(
+  work: (tabId: number) => Promise<T>,
+  maxTimeout: number,
+  unblock: boolean = false
+): Promise<T> => {
+  let expired = false;
+
+  const run = async () => {
+    const tabId = await tabPool.acquire();
+    if (expired) {
+      // The caller gave up while this request waited for a tab
+      recycleTab(tabId, false);
+      throw new Error("Timed out waiting for a tab");
+    }
+
+    let failed = false;
+    try {
+      return await work(tabId);
+    } catch (error) {
+      failed = true;
+      throw error;
+    } finally {
+      // Work that overran the deadline may have left the tab mid-navigation
+      recycleTab(tabId, failed || expired, unblock);
+    }
+  };
+
+  // The deadline covers the wait for a tab as well as the work itself
+  try {
+    return await withTimeout(run(), maxTimeout);
   } catch (error) {
-    console.error(`Error capturing screenshot from ${url}:`, error);
+    expired = true;
     throw error;
-  } finally {
-    if (timeoutId) {
-      clearTimeout(timeoutId);
-    }
-    if (createdTab?.id) {
-      const tabId = createdTab.id;
-      try {
-        await chrome.tabs.remove(tabId);
-        console.log(`Tab ${tabId} closed successfully`);
-      } catch (removeError) {
-        console.error(`Failed to close tab ${tabId}:`, removeError);
-        try {
-          const existingTab = await chrome.tabs.get(tabId);
-          if (existingTab) {
-            await chrome.tabs.remove(tabId);
-          }
-        } catch (retryError) {
-          console.error(`Retry failed to close tab ${tabId}:`, retryError);
-        }
+  }
+};
+
+// Pathological pages can serialize to tens of megabytes; anything past this
+// many characters is cut off and flagged as truncated
+const MAX_HTML_LENGTH = 5 * 1024 * 1024;
+
+const extractHtml = async (
+  url: string,
+  blockResources: boolean = true,
+  maxTimeout: number = 30000
+) => {
+  // Reads the HTML, status code and final URL in a single injection
+  const snapshotPage = (originalUrl: string, maxHtmlLength: number) => {
+    let statusCode = 200;
+    if (window.location.href !== originalUrl) {
+      statusCode = 301;
+    } else {
+      const entries: any = window.performance.getEntries();
+      if (entries.length > 0) {
+        statusCode = entries[0].responseStatus || 200;
       }
     }
+    const html = document.documentElement.outerHTML;
+    return {
+      html: html.length > maxHtmlLength ? html.slice(0, maxHtmlLength) : html,
+      status_code: statusCode,
+      truncated: html.length > maxHtmlLength,
+      url: window.location.href,
+    };
+  };
+
+  console.log(`Processing: ${url}`);
+
+  const extract = async (tabId: number) => {
+    if (blockResources) {
+      await blockSubresources(tabId);
+    }
+    await chrome.tabs.update(tabId, { url });
+    await waitForPageReady(tabId);
+
+    const [snapshot] = await chrome.scripting.executeScript({
+      target: { tabId },
+      func: snapshotPage,
+      args: [url, MAX_HTML_LENGTH],
+    });
+
+    return {
+      html: snapshot.result?.html,
+      status_code: snapshot.result?.status_code,
+      truncated: snapshot.result?.truncated,
+      url: snapshot.result?.url,
+    };
+  };
+
+  return withPooledTab(extract, maxTimeout, blockResources);
+};
+
+type ScreenshotFormat = "jpeg" | "png";
+
+// Chrome rejects captureVisibleTab calls beyond
+// MAX_CAPTURE_VISIBLE_TAB_CALLS_PER_SECOND across the whole extension, so
+// captures from different windows are spaced out instead of running at once
+const CAPTURE_INTERVAL_MS =
+  1000 / chrome.tabs.MAX_CAPTURE_VISIBLE_TAB_CALLS_PER_SECOND;
+let nextCaptureAt = 0;
+
+// Reserves the next capture slot synchronously, then waits until it starts
+const waitForCaptureSlot = async () => {
+  const now = Date.now();
+  const slot = Math.max(now, nextCaptureAt);
+  nextCaptureAt = slot + CAPTURE_INTERVAL_MS;
+  if (slot > now) {
+    await new Promise((resolve) => setTimeout(resolve, slot - now));
+  }
+};
+
+const captureScreenshot = async (
+  url: string,
+  format: ScreenshotFormat = "jpeg",
+  maxTimeout: number = 30000
+) => {
+  console.log(`Capturing screenshot for: ${url}`);
+
+  const capture = async (tabId: number) => {
+    await chrome.tabs.update(tabId, { url, active: true });
+    await waitForPageReady(tabId);
+
+    const { windowId, url: currentUrl } = await chrome.tabs.get(tabId);
+    await waitForCaptureSlot();
+    const screenshot = await chrome.tabs.captureVisibleTab(windowId, {
+      format,
+      quality: 80,
+    });
+
+    return {
+      screenshot: screenshot,
+      url: currentUrl,
+    };
+  };
+
+  return withPooledTab(capture, maxTimeout);
+};
+
+// Resolves each host ahead of the first real navigation. Chrome keys sockets
+// and TLS sessions by network partition and privacy mode, so this
+// uncredentialed service worker request cannot hand its connection to a tab;
+// only the DNS lookup carries over.
+const warmHosts = (hosts: string[]) => {
+  for (const host of hosts) {
+    fetch(`https://${host}/`, {
+      method: "HEAD",
+      mode: "no-cors",
+      credentials: "omit",
+      cache: "no-store",
+    }).catch((error) => {
+      console.warn(`Failed to warm up ${host}:`, error);
+    });
   }
 };
 
+// captureVisibleTab only produces data URLs; decoding here lets the image
+// travel to the server as raw bytes instead of base64 text
+const dataUrlToBytes = async (dataUrl: string) => {
+  const response = await fetch(dataUrl);
+  return new Uint8Array(await response.arrayBuffer());
+};
+
+const PONG_TIMEOUT_MS = 60000;
+
 class WebSocketManager {
   url: string;
   ws: WebSocket | null;
   reconnectDelay: number;
   activeTabs: Set<number>;
+  lastPongAt: number;
 
   constructor(url: string) {
     this.url = url;
     this.ws = null;
     this.reconnectDelay = 1000;
     this.activeTabs = new Set();
+    this.lastPongAt = Date.now();
     this.connect();
     this.setupTabCleanup();
   }
@@ -255,52 +588,34 @@ class WebSocketManager {
 
     this.ws.onopen = () => {
       console.log("WebSocket connected");
+      this.lastPongAt = Date.now();
+
+      // The server sends at most one request per pooled tab
+      tabPool.ready.then(() => {
+        this.send(
+          JSON.stringify({ type: "register", pool_size: tabPool.size })
+        );
+      });
     };
 
     this.ws.onmessage = async (event) => {
       try {
-        const { type, url, request_id } = JSON.parse(event.data);
-
-        if (type == "extractHtml") {
-          try {
-            const extractedData = await extractHtml(url);
-            this.send(
-              JSON.stringify({
-                type: "extractHtml",
-                result: extractedData,
-                request_id,
-              })
-            );
-          } catch (error) {
-            console.error(`Failed to extract HTML for ${url}:`, error);
-            this.send(
-              JSON.stringify({
-                type: "extractHtml",
-                result: { error: String(error) },
-                request_id,
-              })
-            );
-          }
-        } else if (type == "captureScreenshot") {
-          try {
-            const screenshotData = await captureScreenshot(url);
-            this.send(
-              JSON.stringify({
-                type: "captureScreenshot",
-                result: screenshotData,
-                request_id,
-              })
-            );
-          } catch (error) {
-            console.error(`Failed to capture screenshot for ${url}:`, error);
-            this.send(
-              JSON.stringify({
-                type: "captureScreenshot",
-                result: { error: String(error) },
-                request_id,
-              })
-            );
+        const message = JSON.parse(event.data);
+
+        if (message.type == "pong") {
+          this.lastPongAt = Date.now();
+        } else if (message.type == "configure") {
+          networkIdleMs = message.network_idle_ms ?? NETWORK_IDLE_MS;
+        } else if (message.type == "warmHosts") {
+          warmHosts(message.hosts);
+        } else if (message.type == "batch") {
+          // Requests in a batch run concurrently and each is answered with
+          // its own message as soon as it finishes
+          for (const item of message.items) {
+            this.handleRequest(item);
           }
+        } else {
+          await this.handleRequest(message);
         }
       } catch (error) {
         console.error("Error processing WebSocket message:", error);
@@ -319,7 +634,59 @@ class WebSocketManager {
     };
   }
 
-  send(data: string) {
+  async handleRequest(message: any) {
+    const { type, url, request_id, format, block_resources } = message;
+
+    if (type == "extractHtml") {
+      try {
+        const extractedData = await extractHtml(url, block_resources ?? true);
+        this.send(
+          JSON.stringify({
+            type: "extractHtml",
+            result: extractedData,
+            request_id,
+          })
+        );
+      } catch (error) {
+        console.error(`Failed to extract HTML for ${url}:`, error);
+        this.send(
+          JSON.stringify({
+            type: "extractHtml",
+            result: { error: String(error) },
+            request_id,
+          })
+        );
+      }
+    } else if (type == "captureScreenshot") {
+      try {
+        const { screenshot, url: finalUrl } = await captureScreenshot(
+          url,
+          format
+        );
+        this.sendBinary(
+          { type: "captureScreenshot", result: { url: finalUrl }, request_id },
+          await dataUrlToBytes(screenshot)
+        );
+      } catch (error) {
+        console.error(`Failed to capture screenshot for ${url}:`, error);
+        this.send(
+          JSON.stringify({
+            type: "captureScreenshot",
+            result: { error: String(error) },
+            request_id,
+          })
+        );
+      }
+    }
+  }
+
+  // A connection that stopped answering pings is dead even if the socket
+  // still reports OPEN
+  isStale() {
+    return Date.now() - this.lastPongAt > PONG_TIMEOUT_MS;
+  }
+
+  send(data: string | Uint8Array) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
       this.ws.send(data);
     } else {
@@ -327,6 +694,17 @@ class WebSocketManager {
     }
   }
 
+  // Sends a 4-byte big-endian header length, the JSON header and the raw
+  // payload in one binary frame
+  sendBinary(header: object, payload: Uint8Array) {
+    const headerBytes = new TextEncoder().encode(JSON.stringify(header));
+    const frame = new Uint8Array(4 + headerBytes.length + payload.length);
+    new DataView(frame.buffer).setUint32(0, headerBytes.length);
+    frame.set(headerBytes, 4);
+    frame.set(payload, 4 + headerBytes.length);
+    this.send(frame);
+  }
+
   close() {
     if (this.ws) {
       this.ws.close();
@@ -353,7 +731,12 @@ const startKeepAlive = () => {
     });
 
     if (wsManager.ws && wsManager.ws.readyState === WebSocket.OPEN) {
-      wsManager.send(JSON.stringify({ type: "ping", timestamp: Date.now() }));
+      if (wsManager.isStale()) {
+        console.warn("No pong from server, reconnecting");
+        wsManager.close();
+      } else {
+        wsManager.send(JSON.stringify({ type: "ping", timestamp: Date.now() }));
+      }
     }
   }, 20000);
 };